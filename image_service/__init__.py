@@ -0,0 +1,3 @@
+"""Planora image processing service."""
+
+__version__ = "1.0.0"
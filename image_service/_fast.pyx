@@ -0,0 +1,32 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True
+"""Optional compiled hot paths.
+
+Built only when Cython is available at install time (see setup.py); every
+caller keeps a NumPy fallback, so the wheel works without this module.
+"""
+
+from libc.stdint cimport uint8_t, uint16_t
+
+
+cpdef bytes composite_rgba_white(const uint8_t[:, :, ::1] src):
+    """Flatten contiguous RGBA pixels over white; returns packed RGB bytes.
+
+    The integer blend matches the NumPy fallback exactly:
+    ``(c * a + 255 * (255 - a)) // 255``. The tight loop over contiguous
+    memory auto-vectorizes under -O2/-O3.
+    """
+    cdef Py_ssize_t h = src.shape[0]
+    cdef Py_ssize_t w = src.shape[1]
+    cdef bytearray buf = bytearray(h * w * 3)
+    cdef uint8_t[::1] dst = buf
+    cdef Py_ssize_t y, x, o = 0
+    cdef uint16_t a, inv
+    for y in range(h):
+        for x in range(w):
+            a = src[y, x, 3]
+            inv = 255 * (255 - a)
+            dst[o] = <uint8_t>((src[y, x, 0] * a + inv) // 255)
+            dst[o + 1] = <uint8_t>((src[y, x, 1] * a + inv) // 255)
+            dst[o + 2] = <uint8_t>((src[y, x, 2] * a + inv) // 255)
+            o += 3
+    return bytes(buf)
@@ -0,0 +1,426 @@
+"""FastAPI application exposing the image processing pipeline."""
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Tuple
+
+import orjson
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+from . import __version__
+from .config import get_config
+from .core import ImageProcessor
+from .models import HealthResponse, ProcessImageResponse
+
+logger = logging.getLogger(__name__)
+
+# Interactive docs and the OpenAPI schema are development conveniences; the
+# schema build introspects every model and Swagger UI pulls static assets,
+# so both stay off unless explicitly enabled.
+_docs_enabled = os.getenv("IMAGE_SERVICE_ENABLE_DOCS") == "1"
+
+app = FastAPI(
+    title="Planora Image Service",
+    description="Image optimization and document conversion service",
+    version=__version__,
+    default_response_class=ORJSONResponse,
+    docs_url="/docs" if _docs_enabled else None,
+    redoc_url="/redoc" if _docs_enabled else None,
+    openapi_url="/openapi.json" if _docs_enabled else None,
+)
+
+# Explicit origins/methods/headers avoid Starlette reflecting the Origin
+# header per request, and max_age lets browsers cache preflights for a day.
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=list(get_config().cors_allowed_origins),
+    allow_credentials=True,
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
+    max_age=86400,
+)
+
+config = get_config()
+processor = ImageProcessor(config)
+
+# Dedicated pool for the CPU-heavy decode/resize/encode work so it never
+# runs on the event loop thread; sized to the machine, not a fixed 4.
+_encode_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="img-enc")
+
+
+class _TempFilePool:
+    """Bounded pool of reusable upload temp files, keyed by extension.
+
+    Reusing a truncated file avoids the per-request inode create/unlink
+    churn of a fresh NamedTemporaryFile under upload load.
+    """
+
+    def __init__(self, size_per_suffix: int):
+        self._size = size_per_suffix
+        self._free: Dict[str, deque] = {}
+
+    def acquire(self, suffix: str) -> str:
+        bucket = self._free.get(suffix)
+        if bucket:
+            return bucket.popleft()
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        return path
+
+    def release(self, path: str) -> None:
+        suffix = os.path.splitext(path)[1]
+        bucket = self._free.setdefault(suffix, deque())
+        if len(bucket) < self._size:
+            try:
+                with open(path, "r+b") as f:
+                    f.truncate(0)
+            except OSError:
+                return
+            bucket.append(path)
+        else:
+            with suppress(FileNotFoundError):
+                os.unlink(path)
+
+    def drain(self) -> None:
+        for bucket in self._free.values():
+            while bucket:
+                with suppress(FileNotFoundError):
+                    os.unlink(bucket.popleft())
+
+
+_temp_pool = _TempFilePool(config.upload_pool_size)
+
+# Maps document id -> processed image path so GET /image/{doc_id} can serve
+# the bytes via FileResponse (os.sendfile under the hood) instead of clients
+# re-reading paths out of the JSON document. LRU-bounded like the result
+# cache; the service is long-lived, so an unbounded map would grow by one
+# entry per upload forever.
+_doc_index: "OrderedDict[str, str]" = OrderedDict()
+
+
+def _index_document(doc_id: str, path: str) -> None:
+    _doc_index[doc_id] = path
+    _doc_index.move_to_end(doc_id)
+    while len(_doc_index) > config.cache_size:
+        _doc_index.popitem(last=False)
+
+# Content-addressed cache of processed results: identical uploads skip the
+# full decode/optimize/encode pipeline. Keyed by upload digest + format +
+# workspace — the workspace determines where the output lands, so identical
+# bytes for different workspaces are distinct results.
+_result_cache: "OrderedDict[Tuple[str, str, Optional[str]], object]" = OrderedDict()
+
+
+def _cache_get(key: Tuple[str, str, Optional[str]]):
+    document = _result_cache.get(key)
+    if document is None:
+        return None
+    # The cached output may have been cleaned up out-of-band; verify before
+    # short-circuiting the pipeline.
+    if not os.path.exists(document.file_path):
+        del _result_cache[key]
+        return None
+    _result_cache.move_to_end(key)
+    return document
+
+
+def _cache_put(key: Tuple[str, str, Optional[str]], document) -> None:
+    _result_cache[key] = document
+    _result_cache.move_to_end(key)
+    while len(_result_cache) > config.cache_size:
+        _result_cache.popitem(last=False)
+
+
+@app.on_event("shutdown")
+def _drain_temp_pool():
+    _temp_pool.drain()
+
+
+# Non-file form fields (workspace, output_format, stream) are a few bytes
+# each; anything beyond this is malformed or malicious, and without a cap a
+# single huge text field would be buffered wholesale in memory.
+_MAX_FIELD_SIZE = 64 * 1024
+
+
+class _UploadParser:
+    """Streaming multipart parser for the upload endpoint.
+
+    Starlette's UploadFile spools the body to a temp file that we would
+    then read back and write out again — three copies of every upload.
+    Parsing the multipart stream ourselves lets the file part go straight
+    from the ASGI receive channel to the pooled temp file with os.write,
+    while small form fields are collected in memory.
+    """
+
+    def __init__(self, boundary: bytes):
+        self.fields: Dict[str, str] = {}
+        self.filename: Optional[str] = None
+        self.temp_file_path: Optional[str] = None
+        self.total = 0
+        self.hasher = hashlib.blake2b(digest_size=32)
+        self._fd: Optional[int] = None
+        self._part_name = ""
+        self._is_file_part = False
+        self._value = bytearray()
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._headers: Dict[bytes, bytes] = {}
+        self._parser = MultipartParser(
+            boundary,
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+            },
+        )
+
+    def feed(self, chunk: bytes) -> None:
+        self._parser.write(chunk)
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+        self._value = bytearray()
+        self._is_file_part = False
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[bytes(self._header_field).lower()] = bytes(self._header_value)
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+
+    def _on_headers_finished(self) -> None:
+        _, params = parse_options_header(
+            self._headers.get(b"content-disposition", b"")
+        )
+        self._part_name = params.get(b"name", b"").decode("latin-1")
+        filename = params.get(b"filename")
+        self._is_file_part = filename is not None
+        if self._is_file_part:
+            self.filename = filename.decode("utf-8", errors="replace")
+            suffix = os.path.splitext(self.filename)[1].lower()
+            if not self.filename or suffix not in config.supported_ext_set:
+                raise HTTPException(
+                    status_code=400, detail=f"Unsupported file format: {suffix}"
+                )
+            if self.temp_file_path is not None:
+                # A second file part supersedes the first; return the
+                # earlier temp file instead of stranding it.
+                self.close()
+                _temp_pool.release(self.temp_file_path)
+                self.total = 0
+                self.hasher = hashlib.blake2b(digest_size=32)
+            self.temp_file_path = _temp_pool.acquire(suffix)
+            self._fd = os.open(self.temp_file_path, os.O_WRONLY | os.O_TRUNC)
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._is_file_part:
+            chunk = data[start:end]
+            self.total += len(chunk)
+            # Enforce the size cap as bytes arrive: oversized (or malicious)
+            # uploads are rejected mid-stream instead of being written out in
+            # full first.
+            if self.total > config.max_file_size:
+                raise HTTPException(
+                    status_code=413, detail="File exceeds maximum size"
+                )
+            self.hasher.update(chunk)
+            os.write(self._fd, chunk)
+        else:
+            self._value += data[start:end]
+            # Reject mid-stream like the file-size cap above; fields this
+            # large would otherwise buffer unbounded in memory.
+            if len(self._value) > _MAX_FIELD_SIZE:
+                raise HTTPException(
+                    status_code=413, detail="Form field exceeds maximum size"
+                )
+
+    def _on_part_end(self) -> None:
+        if self._is_file_part:
+            self.close()
+        else:
+            self.fields[self._part_name] = bytes(self._value).decode("utf-8")
+
+
+@app.post("/process_image", response_model=ProcessImageResponse)
+async def process_image(request: Request):
+    """Process an uploaded image and return the resulting document.
+
+    With ``stream=true`` the encoded image bytes are returned directly as
+    they become available instead of a JSON-embedded document.
+    """
+    content_type, params = parse_options_header(
+        request.headers.get("content-type", "")
+    )
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected multipart/form-data")
+
+    parser = _UploadParser(params[b"boundary"])
+    try:
+        try:
+            # feed() does the os.write to the temp file; on a thread it
+            # can block on contended storage without stalling every other
+            # request sharing the event loop.
+            async for chunk in request.stream():
+                await run_in_threadpool(parser.feed, chunk)
+        finally:
+            parser.close()
+        temp_file_path = parser.temp_file_path
+
+        if not parser.filename or temp_file_path is None:
+            raise HTTPException(status_code=400, detail="No file provided")
+
+        filename = parser.filename
+        workspace = parser.fields.get("workspace") or None
+        output_format = parser.fields.get("output_format", "webp")
+        stream = parser.fields.get("stream", "").lower() in ("1", "true", "yes")
+        total = parser.total
+        logger.info("Processing uploaded file: %s (%d bytes)", filename, total)
+
+        if stream:
+            media_format = "jpeg" if output_format == "jpg" else output_format
+            # Encode before any response object exists: once a streaming
+            # response has sent its 200 status line, a validation or
+            # encode failure can only abort the body, not become a 4xx.
+            try:
+                data = await processor.encode_image(temp_file_path, output_format)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            return Response(content=data, media_type=f"image/{media_format}")
+
+        cache_key = (parser.hasher.hexdigest(), output_format, workspace)
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            logger.info("Cache hit for upload %s", filename)
+            return ProcessImageResponse(success=True, document=cached.model_copy(deep=True))
+
+        document = await asyncio.get_running_loop().run_in_executor(
+            _encode_pool, processor.process_sync, temp_file_path, workspace, output_format
+        )
+        _cache_put(cache_key, document)
+        _index_document(document.document_id, document.file_path)
+        return ProcessImageResponse(success=True, document=document.model_copy(deep=True))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Processing failed for %s: %s", parser.filename, e)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Release whatever the parser acquired, not a local copy: the
+        # pooled file is acquired inside the headers callback, so a feed()
+        # failure (malformed multipart, client abort, mid-stream 413)
+        # happens before any local assignment and would leak it otherwise.
+        # The release truncates the file, which is also disk I/O that
+        # belongs on a thread.
+        if parser.temp_file_path:
+            await run_in_threadpool(_temp_pool.release, parser.temp_file_path)
+            logger.debug("Returned temp file to pool: %s", parser.temp_file_path)
+
+
+@app.get("/image/{doc_id}")
+async def get_image(doc_id: str):
+    """Serve a processed image by document id (zero-copy via sendfile)."""
+    path = _doc_index.get(doc_id)
+    if path is None or not os.path.exists(path):
+        # Drop ids whose files were cleaned up out-of-band rather than
+        # letting dead entries occupy LRU slots until evicted.
+        if path is not None:
+            del _doc_index[doc_id]
+        raise HTTPException(status_code=404, detail="Unknown document id")
+    _doc_index.move_to_end(doc_id)
+    ext = os.path.splitext(path)[1].lstrip(".")
+    media_format = "jpeg" if ext == "jpg" else ext
+    return FileResponse(path, media_type=f"image/{media_format}")
+
+
+# /health fires every few seconds from orchestrator probes; everything but
+# the timestamp is static, so serve prebuilt JSON bytes refreshed at most
+# once per second instead of building a model per call.
+_health_body: bytes = b""
+_health_expires: float = 0.0
+
+
+def _health_payload() -> bytes:
+    global _health_body, _health_expires
+    now = time.time()
+    if now >= _health_expires:
+        _health_body = (
+            HealthResponse(
+                status="healthy",
+                service="image_service",
+                version=__version__,
+                timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                supported_formats=processor.get_supported_formats(),
+            )
+            .model_dump_json()
+            .encode()
+        )
+        _health_expires = now + 1.0
+    return _health_body
+
+
+@app.get("/health", response_model=HealthResponse)
+async def health_check():
+    """Liveness/readiness probe."""
+    return Response(content=_health_payload(), media_type="application/json")
+
+
+# The config payload is immutable for the life of the process; serialize it
+# once at import instead of rebuilding the dict per request.
+_CONFIG_JSON = orjson.dumps(
+    {
+        "max_file_size": config.max_file_size,
+        "supported_extensions": config.supported_extensions,
+        "output_format": config.output_format,
+        "webp_quality": config.webp_quality,
+        "jpeg_quality": config.jpeg_quality,
+        "thumbnail_size": config.thumbnail_size,
+        "max_image_size": config.pdf_max_image_size,
+    }
+)
+
+
+@app.get("/config")
+async def get_service_config():
+    """Expose the non-sensitive parts of the active configuration."""
+    return Response(content=_CONFIG_JSON, media_type="application/json")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvloop + httptools measurably raise large-upload throughput over the
+    # default asyncio loop; production deployments should pass the same
+    # flags: uvicorn image_service.api:app --loop uvloop --http httptools
+    uvicorn.run(
+        "image_service.api:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        reload=True,
+    )
@@ -0,0 +1,144 @@
+"""Command line interface for the image service."""
+
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from types import MappingProxyType
+from typing import List, Optional
+
+import orjson
+import typer
+from rich.console import Console
+from rich.progress import Progress
+from rich.table import Table
+
+from .config import get_config
+from .core import ImageProcessor
+
+logger = logging.getLogger(__name__)
+
+app = typer.Typer(help="Planora image processing CLI")
+console = Console()
+
+_FORMAT_DESCRIPTIONS = MappingProxyType({
+    ".jpg": "JPEG image",
+    ".jpeg": "JPEG image",
+    ".png": "Portable Network Graphics",
+    ".webp": "WebP image",
+    ".bmp": "Windows bitmap",
+    ".tiff": "Tagged Image File Format",
+    ".gif": "Graphics Interchange Format",
+})
+
+
+@functools.cache
+def _get_processor() -> ImageProcessor:
+    """Shared processor instance; construction warms caches once."""
+    return ImageProcessor(get_config())
+
+
+@app.command()
+def process(
+    file_path: Path = typer.Argument(..., help="Image file to process"),
+    workspace: Optional[str] = typer.Option(None, help="Workspace name"),
+    output_format: Optional[str] = typer.Option(None, help="Output format (webp/jpeg/png)"),
+    output: Optional[Path] = typer.Option(None, help="Write the document JSON to this file"),
+    pretty: bool = typer.Option(True, help="Pretty-print JSON output"),
+):
+    """Process a single image and print the resulting document."""
+    processor = _get_processor()
+    try:
+        document = processor.process_sync(str(file_path), workspace, output_format)
+    except ValueError as e:
+        console.print(f"[red]Error:[/red] {e}")
+        raise typer.Exit(code=1)
+
+    json_output = document.model_dump()
+    if output:
+        option = orjson.OPT_INDENT_2 if pretty else 0
+        output.write_bytes(orjson.dumps(json_output, option=option))
+        console.print(f"Document written to {output}")
+    else:
+        console.print_json(data=json_output)
+
+
+@app.command()
+def batch(
+    paths: List[Path] = typer.Argument(..., help="Image files to process"),
+    workspace: Optional[str] = typer.Option(None, help="Workspace name"),
+    output_format: Optional[str] = typer.Option(None, help="Output format (webp/jpeg/png)"),
+    workers: int = typer.Option(os.cpu_count(), help="Number of parallel workers"),
+):
+    """Process a batch of images in parallel."""
+    processor = _get_processor()
+    failures = 0
+    with Progress(console=console) as progress:
+        task = progress.add_task("Processing", total=len(paths))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    processor.process_sync, str(path), workspace, output_format
+                ): path
+                for path in paths
+            }
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    document = future.result()
+                    console.print(f"[green]OK:[/green] {path} -> {document.file_path}")
+                except Exception as e:
+                    failures += 1
+                    console.print(f"[red]Failed:[/red] {path}: {e}")
+                progress.advance(task)
+    if failures:
+        console.print(f"[red]{failures} of {len(paths)} files failed[/red]")
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def validate(
+    file_path: Path = typer.Argument(..., help="Image file to validate"),
+):
+    """Validate that a file can be processed without processing it."""
+    processor = _get_processor()
+    valid, message = processor.validate_file(str(file_path))
+    if valid:
+        console.print(f"[green]OK:[/green] {file_path}")
+    else:
+        console.print(f"[red]Invalid:[/red] {message}")
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def formats():
+    """List the supported input formats."""
+    processor = _get_processor()
+    table = Table(title="Supported formats")
+    table.add_column("Extension")
+    table.add_column("Description")
+    for ext in processor.get_supported_formats():
+        table.add_row(ext, _FORMAT_DESCRIPTIONS.get(ext, "Image"))
+    console.print(table)
+
+
+@app.command(name="config")
+def show_config():
+    """Show the active configuration."""
+    config = get_config()
+    table = Table(title="Image service configuration")
+    table.add_column("Setting")
+    table.add_column("Value")
+    table.add_row("max_file_size", str(config.max_file_size))
+    table.add_row("supported_extensions", ", ".join(config.supported_extensions))
+    table.add_row("output_format", config.output_format)
+    table.add_row("webp_quality", str(config.webp_quality))
+    table.add_row("jpeg_quality", str(config.jpeg_quality))
+    table.add_row("thumbnail_size", str(config.thumbnail_size))
+    table.add_row("max_image_size", f"{config.pdf_max_image_width}x{config.pdf_max_image_height}")
+    console.print(table)
+
+
+if __name__ == "__main__":
+    app()
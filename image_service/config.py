@@ -0,0 +1,169 @@
+"""Configuration for the image service.
+
+Settings are parsed from environment variables (``IMAGE_SERVICE_`` prefix)
+once, by a pydantic loader, and then frozen into a plain slotted dataclass.
+Hot paths read raw attributes instead of going through pydantic's
+``__getattr__`` machinery, and ``pdf_max_image_size`` is precomputed rather
+than rebuilt on every access.
+"""
+
+import logging
+import os
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+logger = logging.getLogger(__name__)
+
+
+class _EnvSettings(BaseSettings):
+    """Environment parser; only used to build :class:`ImageServiceConfig`."""
+
+    workspace_dir: str = Field(default="workspace", description="Root directory for processed output")
+    temp_dir: str = Field(default="temp", description="Directory for intermediate files")
+    max_file_size: int = Field(default=50 * 1024 * 1024, description="Maximum upload size in bytes")
+    upload_pool_size: int = Field(default=8, description="Number of reusable upload temp files kept per extension")
+    cache_size: int = Field(default=128, description="Entries kept in the processed-result content cache")
+    supported_extensions: List[str] = Field(
+        default=[".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tiff", ".gif"],
+        description="File extensions accepted for processing",
+    )
+    cors_allowed_origins: List[str] = Field(
+        default=["http://localhost:3000", "http://localhost:8080"],
+        description="Origins allowed to call the API from a browser",
+    )
+    output_format: str = Field(default="webp", description="Default output image format")
+    webp_quality: int = Field(default=85, description="Quality for WebP encoding (0-100)")
+    webp_method: int = Field(default=4, description="WebP effort for main saves (0 fastest - 6 smallest)")
+    jpeg_quality: int = Field(default=90, description="Quality for JPEG encoding (0-100)")
+    thumbnail_size: int = Field(default=256, description="Bounding box edge for thumbnails")
+    thumbnail_format: str = Field(default="webp", description="Thumbnail encoding: webp or jpeg")
+    max_display_size: int = Field(
+        default=0,
+        description="Largest size ever displayed; 0 disables the single-encode shortcut",
+    )
+    hash_algo: str = Field(default="xxh3", description="Filename hash: xxh3 or md5 (legacy names)")
+    pdf_max_image_width: int = Field(default=2048, description="Maximum output image width")
+    pdf_max_image_height: int = Field(default=2048, description="Maximum output image height")
+
+    model_config = SettingsConfigDict(
+        env_prefix="IMAGE_SERVICE_", case_sensitive=False, frozen=True
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class ImageServiceConfig:
+    """Immutable service configuration; attribute access is C-level fast."""
+
+    workspace_dir: str
+    temp_dir: str
+    max_file_size: int
+    upload_pool_size: int
+    cache_size: int
+    supported_extensions: Tuple[str, ...]
+    supported_ext_set: frozenset
+    cors_allowed_origins: Tuple[str, ...]
+    output_format: str
+    webp_quality: int
+    webp_method: int
+    jpeg_quality: int
+    thumbnail_size: int
+    thumbnail_format: str
+    max_display_size: int
+    hash_algo: str
+    pdf_max_image_width: int
+    pdf_max_image_height: int
+    pdf_max_image_size: Tuple[int, int]
+
+    def is_supported_format(self, file_path: str) -> bool:
+        """Check whether a file's extension is one we can process."""
+        return os.path.splitext(file_path)[1].lower() in self.supported_ext_set
+
+    # The path helpers run on every save/thumbnail/copy; the config is a
+    # frozen (hashable) dataclass, so the joined Path objects can be cached
+    # per (config, workspace) instead of rebuilt each call.
+
+    @lru_cache(maxsize=32)
+    def get_workspace_path(self, workspace: Optional[str] = None) -> Path:
+        """Resolve the workspace root, optionally namespaced per caller."""
+        base = Path(self.workspace_dir)
+        if workspace:
+            base = base / workspace
+        return base
+
+    @lru_cache(maxsize=32)
+    def get_image_store_path(self, workspace: Optional[str] = None) -> Path:
+        """Directory where processed images are stored."""
+        return self.get_workspace_path(workspace) / "images"
+
+    @lru_cache(maxsize=32)
+    def get_thumbnail_path(self, workspace: Optional[str] = None) -> Path:
+        """Directory where thumbnails are stored."""
+        return self.get_workspace_path(workspace) / "thumbnails"
+
+    def ensure_directories(self, workspace: Optional[str] = None) -> None:
+        """Create the workspace directory tree if it does not exist.
+
+        Cached per (config, workspace): after the first call the repeated
+        per-save invocations cost a dict lookup, not four mkdir syscalls.
+        """
+        _ensure_directories(self, workspace)
+
+
+@lru_cache(maxsize=64)
+def _ensure_directories(config: ImageServiceConfig, workspace: Optional[str]) -> None:
+    for path in (
+        config.get_workspace_path(workspace),
+        config.get_image_store_path(workspace),
+        config.get_thumbnail_path(workspace),
+        config.temp_dir,
+    ):
+        os.makedirs(path, exist_ok=True)
+
+
+def _build_config(settings: dict) -> ImageServiceConfig:
+    """Freeze parsed settings into the immutable runtime config."""
+    settings = dict(settings)
+    settings["supported_extensions"] = tuple(settings["supported_extensions"])
+    settings["supported_ext_set"] = frozenset(settings["supported_extensions"])
+    settings["cors_allowed_origins"] = tuple(settings["cors_allowed_origins"])
+    settings["pdf_max_image_size"] = (
+        settings["pdf_max_image_width"],
+        settings["pdf_max_image_height"],
+    )
+    return ImageServiceConfig(**settings)
+
+
+_config: Optional[ImageServiceConfig] = None
+
+
+def get_config() -> ImageServiceConfig:
+    """Return the process-wide configuration, loading it on first use."""
+    global _config
+    if _config is None:
+        _config = _build_config(_EnvSettings().model_dump())
+        logger.info("Loaded configuration (output format: %s)", _config.output_format)
+    return _config
+
+
+def update_config(**overrides) -> ImageServiceConfig:
+    """Rebuild the process-wide configuration with the given overrides."""
+    global _config
+    updated = replace(get_config(), **overrides)
+    if "pdf_max_image_width" in overrides or "pdf_max_image_height" in overrides:
+        updated = replace(
+            updated,
+            pdf_max_image_size=(updated.pdf_max_image_width, updated.pdf_max_image_height),
+        )
+    if "supported_extensions" in overrides:
+        updated = replace(
+            updated,
+            supported_extensions=tuple(updated.supported_extensions),
+            supported_ext_set=frozenset(updated.supported_extensions),
+        )
+    _config = updated
+    return _config
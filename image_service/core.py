@@ -0,0 +1,428 @@
+"""Core image processing pipeline."""
+
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import queue
+import stat
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import PIL
+from PIL import Image
+
+try:
+    from . import _fast
+except ImportError:  # extension not built; NumPy paths cover everything
+    _fast = None
+
+from .config import ImageServiceConfig
+from .metadata import MetadataExtractor
+from .models import Document, ImageMetadata, Page
+from .storage import ImageStorage
+
+logger = logging.getLogger(__name__)
+
+# Pillow-SIMD versions carry a ".postN" suffix; resize falls back to the
+# scalar kernels when it's absent, which is worth knowing when profiling.
+_SIMD_RESAMPLING = "post" in PIL.__version__
+
+
+def _warm_worker() -> None:
+    """Pool-worker initializer: force Pillow plugin registration up front.
+
+    The first Image.open/save in a fresh process otherwise pays the lazy
+    plugin scan (tens of ms) on its first real request; the tiny WebP
+    round-trip also pulls libwebp in immediately.
+    """
+    Image.preinit()
+    Image.init()
+    buf = io.BytesIO()
+    Image.new("RGB", (1, 1)).save(buf, format="WEBP")
+
+
+def _composite_over_white(image: Image.Image) -> Image.Image:
+    """Flatten an RGBA image over white, returning RGB.
+
+    Runs the blend as vectorized NumPy array math on the channel planes
+    instead of building a full-size white background image and calling
+    alpha_composite: one pass over the pixels, no destination allocation,
+    no intermediate RGBA result to convert afterwards. The uint16 integer
+    blend is exact and identical to the thumbnail path and the compiled
+    _fast kernel, so output never depends on which path ran.
+    """
+    arr = np.asarray(image, dtype=np.uint8)
+    if _fast is not None:
+        return Image.frombytes(
+            "RGB", image.size, _fast.composite_rgba_white(np.ascontiguousarray(arr))
+        )
+    rgb = arr[..., :3].astype(np.uint16)
+    alpha = arr[..., 3:4].astype(np.uint16)
+    out = ((rgb * alpha + 255 * (255 - alpha)) // 255).astype(np.uint8)
+    return Image.fromarray(out, "RGB")
+
+
+class ImageProcessor:
+    """Runs the validate → load → optimize → save pipeline for one image."""
+
+    def __init__(self, config: ImageServiceConfig):
+        self.config = config
+        self.storage = ImageStorage(config)
+        self.metadata_extractor = MetadataExtractor()
+        self._supported_exts = frozenset(config.supported_extensions)
+        self._supported_formats = list(config.supported_extensions)
+        self._max_width, self._max_height = config.pdf_max_image_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        if not _SIMD_RESAMPLING:
+            logger.debug(
+                "Pillow-SIMD not detected (PIL %s); LANCZOS resize runs scalar",
+                PIL.__version__,
+            )
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Worker pool for CPU-bound pipeline runs, created on first use.
+
+        Lazy creation matters: the pool's own worker processes rebuild an
+        ImageProcessor and must never recursively spawn pools.
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=_warm_worker,
+            )
+        return self._executor
+
+    def validate_file(self, file_path: str) -> Tuple[bool, str]:
+        """Check that a file exists, is non-empty and has a supported format.
+
+        One stat syscall answers existence, file type and size together;
+        the exists/is_file/stat chain costs three, which matters on batch
+        scans over network filesystems.
+        """
+        try:
+            st = os.stat(file_path)
+        except (FileNotFoundError, NotADirectoryError):
+            return False, f"File not found: {file_path}"
+        if not stat.S_ISREG(st.st_mode):
+            return False, f"Not a regular file: {file_path}"
+        if st.st_size == 0:
+            return False, f"File is empty: {file_path}"
+        if st.st_size > self.config.max_file_size:
+            return False, f"File exceeds maximum size ({st.st_size} > {self.config.max_file_size})"
+        suffix = os.path.splitext(file_path)[1].lower()
+        if suffix not in self._supported_exts:
+            return False, f"Unsupported format: {suffix}"
+        return True, "OK"
+
+    def load_image(self, file_path: str) -> Image.Image:
+        """Load an image fully into memory, detached from its file handle.
+
+        JPEG sources are decoded through ``Image.draft`` at the nearest
+        DCT scale above twice the output bound, so huge camera JPEGs never
+        materialize at full resolution just to be downscaled again.
+
+        After ``load()`` the pixel data lives in memory independent of the
+        file, so the image is returned as-is; the defensive ``copy()`` this
+        method used to make doubled peak memory for nothing.
+        """
+        img = Image.open(file_path)
+        if img.format == "JPEG":
+            img.draft("RGB", (self._max_width * 2, self._max_height * 2))
+        img.load()
+        return img
+
+    def _load_and_optimize(self, file_path: str):
+        """Decode straight into the optimized output image.
+
+        Skips the defensive full-image copy that :meth:`load_image` makes
+        (the decoded buffer outlives the file handle after ``load()``) and
+        extracts metadata while the source is still open, so the original
+        pixels are never retained alongside the optimized image. Returns
+        ``(optimized_image, metadata)``.
+        """
+        with Image.open(file_path) as img:
+            # Captured before draft(): the scaled decode shrinks img.size,
+            # but the metadata documents the source dimensions.
+            source_size = img.size
+            if img.format == "JPEG":
+                img.draft("RGB", (self._max_width * 2, self._max_height * 2))
+            img.load()
+            # Checked once here and threaded through: metadata extraction
+            # would otherwise repeat the same mode/info inspection.
+            has_transparency = self.metadata_extractor._check_transparency(img)
+            metadata = self.metadata_extractor.create_image_metadata(
+                img, has_transparency, source_size
+            )
+            image = img
+        return self.optimize_image(image), metadata
+
+    def optimize_image(self, image: Image.Image) -> Image.Image:
+        """Convert to RGB and downscale to the configured maximum size."""
+        if image.mode in ("RGBA", "LA", "P"):
+            if image.mode != "RGBA":
+                image = image.convert("RGBA")
+            image = _composite_over_white(image)
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        # thumbnail() computes the aspect-preserving target in C, resizes in
+        # place (no fresh Image allocation) and is a no-op when the image
+        # already fits the bounds; reducing_gap keeps the box-reduce +
+        # convolve path for large downscales.
+        image.thumbnail(
+            (self._max_width, self._max_height),
+            Image.Resampling.LANCZOS,
+            reducing_gap=3.0,
+        )
+
+        return image
+
+    def create_document(
+        self,
+        file_path: str,
+        image_path: str,
+        thumbnail_path: str,
+        metadata: ImageMetadata,
+        document_id: Optional[str] = None,
+    ) -> Document:
+        """Assemble a single-page :class:`Document` for a processed image."""
+        if document_id is None:
+            # Nanosecond resolution keeps ids unique across sub-second batch
+            # runs, where second-resolution ids collided.
+            document_id = f"doc_img_{time.time_ns()}"
+        # Internal construction from trusted values: model_construct skips
+        # validation; the API boundary still validates normally.
+        page = Page.model_construct(
+            page_number=1,
+            image_path=image_path,
+            thumbnail_path=thumbnail_path,
+            metadata=metadata,
+        )
+        document = Document.model_construct(
+            document_id=document_id,
+            document_name=Path(file_path).name,
+            file_path=image_path,
+            pages=[page],
+            created_at=datetime.now().isoformat(timespec="seconds"),
+        )
+        document.update_page_references()
+        return document
+
+    def process_sync(
+        self,
+        file_path: str,
+        workspace: Optional[str] = None,
+        output_format: Optional[str] = None,
+        document_id: Optional[str] = None,
+    ) -> Document:
+        """Run the full pipeline synchronously and return the document."""
+        valid, message = self.validate_file(file_path)
+        if not valid:
+            raise ValueError(message)
+
+        optimized_image, metadata = self._load_and_optimize(file_path)
+
+        image_path, size, thumbnail_path = self.storage.save_image_and_thumbnail(
+            optimized_image, file_path, workspace, output_format
+        )
+        logger.info("Processed %s -> %s (%d bytes)", file_path, image_path, size)
+        return self.create_document(
+            file_path, image_path, thumbnail_path, metadata, document_id
+        )
+
+    def process_batch(
+        self,
+        files: List[str],
+        workspace: Optional[str] = None,
+        output_format: Optional[str] = None,
+    ) -> List[Tuple[str, Optional[Document], Optional[str]]]:
+        """Process several images through a three-stage pipeline.
+
+        Loader, optimizer and encoder run in separate threads connected by
+        bounded queues of two items: while image N encodes (CPU-heavy,
+        GIL released in the codec), image N+1 is being resized and N+2
+        decoded, overlapping the memory-bandwidth and CPU phases that a
+        serial loop leaves idle. The small queue bound keeps at most a
+        handful of decoded images in memory at once.
+
+        Returns one ``(file_path, document, error)`` tuple per input file,
+        in input order; ``error`` is None on success.
+        """
+        decoded: "queue.Queue" = queue.Queue(maxsize=2)
+        optimized: "queue.Queue" = queue.Queue(maxsize=2)
+        results: List[Tuple[str, Optional[Document], Optional[str]]] = [
+            (path, None, "not processed") for path in files
+        ]
+
+        def loader() -> None:
+            for index, path in enumerate(files):
+                valid, message = self.validate_file(path)
+                if not valid:
+                    results[index] = (path, None, message)
+                    continue
+                try:
+                    with Image.open(path) as img:
+                        source_size = img.size
+                        if img.format == "JPEG":
+                            img.draft(
+                                "RGB", (self._max_width * 2, self._max_height * 2)
+                            )
+                        img.load()
+                        metadata = self.metadata_extractor.create_image_metadata(
+                            img,
+                            self.metadata_extractor._check_transparency(img),
+                            source_size,
+                        )
+                        decoded.put((index, path, img, metadata))
+                except Exception as e:
+                    results[index] = (path, None, str(e))
+            decoded.put(None)
+
+        def optimizer() -> None:
+            while (item := decoded.get()) is not None:
+                index, path, img, metadata = item
+                try:
+                    optimized.put((index, path, self.optimize_image(img), metadata))
+                except Exception as e:
+                    results[index] = (path, None, str(e))
+            optimized.put(None)
+
+        def encoder() -> None:
+            while (item := optimized.get()) is not None:
+                index, path, img, metadata = item
+                try:
+                    image_path, size = self.storage.save_image(
+                        img, path, workspace, output_format
+                    )
+                    thumbnail_path = self.storage.create_thumbnail(
+                        img, path, workspace
+                    )
+                    document = self.create_document(
+                        path, image_path, thumbnail_path, metadata
+                    )
+                    results[index] = (path, document, None)
+                    logger.info(
+                        "Processed %s -> %s (%d bytes)", path, image_path, size
+                    )
+                except Exception as e:
+                    results[index] = (path, None, str(e))
+
+        threads = [
+            threading.Thread(target=loader, name="batch-load"),
+            threading.Thread(target=optimizer, name="batch-optimize"),
+        ]
+        for thread in threads:
+            thread.start()
+        encoder()
+        for thread in threads:
+            thread.join()
+        return results
+
+    async def process(
+        self,
+        file_path: str,
+        workspace: Optional[str] = None,
+        output_format: Optional[str] = None,
+        document_id: Optional[str] = None,
+    ) -> Document:
+        """Async wrapper running the pipeline on the process pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            _worker_process_image,
+            self.config,
+            file_path,
+            workspace,
+            output_format,
+            document_id,
+        )
+
+    async def encode_image(
+        self,
+        file_path: str,
+        output_format: Optional[str] = None,
+    ) -> bytes:
+        """Validate, optimize and encode an image, returning the payload.
+
+        Raises ``ValueError`` for invalid files before any work is
+        submitted, so callers can still turn failures into proper error
+        responses.
+        """
+        output_format = output_format or self.config.output_format
+        valid, message = self.validate_file(file_path)
+        if not valid:
+            raise ValueError(message)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, _worker_encode, self.config, file_path, output_format
+        )
+
+    async def process_stream(
+        self,
+        file_path: str,
+        workspace: Optional[str] = None,
+        output_format: Optional[str] = None,
+        chunk_size: int = 1 << 16,
+    ):
+        """Optimize an image and yield the encoded bytes in chunks.
+
+        Thin wrapper over :meth:`encode_image`; callers that need failures
+        surfaced before the first byte (the API's streaming mode) should
+        call that directly, since exceptions from an async generator only
+        fire once iteration — and therefore the response — has started.
+        """
+        data = await self.encode_image(file_path, output_format)
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size]
+
+    def get_supported_formats(self) -> List[str]:
+        """Return the accepted input extensions."""
+        return self._supported_formats
+
+
+# Worker-process entry points. Submitting bound methods would pickle the
+# whole ImageProcessor (executor included); instead each worker rebuilds one
+# processor from the frozen config and reuses it across jobs.
+
+
+@lru_cache(maxsize=2)
+def _worker_processor(config: ImageServiceConfig) -> ImageProcessor:
+    return ImageProcessor(config)
+
+
+def _worker_process_image(
+    config: ImageServiceConfig,
+    file_path: str,
+    workspace: Optional[str],
+    output_format: Optional[str],
+    document_id: Optional[str] = None,
+) -> Document:
+    return _worker_processor(config).process_sync(
+        file_path, workspace, output_format, document_id
+    )
+
+
+def _worker_encode(
+    config: ImageServiceConfig, file_path: str, output_format: str
+) -> bytes:
+    processor = _worker_processor(config)
+    image, _ = processor._load_and_optimize(file_path)
+    buf = io.BytesIO()
+    if output_format == "webp":
+        image.save(buf, "WEBP", quality=config.webp_quality)
+    elif output_format in ("jpeg", "jpg"):
+        image.save(buf, "JPEG", quality=config.jpeg_quality)
+    else:
+        image.save(buf, output_format.upper())
+    return buf.getvalue()
@@ -0,0 +1,129 @@
+"""Metadata extraction helpers for processed images."""
+
+import logging
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+from PIL.ExifTags import TAGS
+
+from .models import ImageMetadata
+
+logger = logging.getLogger(__name__)
+
+_USEFUL_EXIF_FIELDS = frozenset({
+    "Make", "Model", "DateTime", "DateTimeOriginal", "Software",
+    "Orientation", "XResolution", "YResolution", "ResolutionUnit",
+    "ExposureTime", "FNumber", "ISOSpeedRatings", "FocalLength",
+})
+
+# Resolved once: tag id -> name for just the fields we keep, so extraction
+# probes 13 ids instead of walking (and decoding) every tag in the file.
+_USEFUL_EXIF_TAGS = {
+    tag_id: name for tag_id, name in TAGS.items() if name in _USEFUL_EXIF_FIELDS
+}
+
+
+class MetadataExtractor:
+    """Extracts basic, EXIF and colour metadata from PIL images."""
+
+    def extract_basic_metadata(
+        self,
+        image: Image.Image,
+        has_transparency: Optional[bool] = None,
+        source_size: Optional[Tuple[int, int]] = None,
+    ) -> Dict[str, Any]:
+        """Return the core properties of an image.
+
+        Callers that already know whether the image carries transparency
+        (the optimize path checks the mode anyway) pass it in rather than
+        having it recomputed here. ``source_size`` overrides the image's
+        own dimensions for callers that have applied ``draft()``, whose
+        scaled decode would otherwise be reported as the source size.
+        """
+        if has_transparency is None:
+            has_transparency = self._check_transparency(image)
+        width, height = source_size if source_size is not None else image.size
+        return {
+            "width": width,
+            "height": height,
+            "mode": image.mode,
+            "format": image.format,
+            "has_transparency": has_transparency,
+        }
+
+    def _check_transparency(self, image: Image.Image) -> bool:
+        """Whether the image carries an alpha channel or transparency info."""
+        if image.mode in ("RGBA", "LA"):
+            return True
+        if image.mode == "P" and "transparency" in image.info:
+            return True
+        return False
+
+    def extract_exif_data(self, image: Image.Image) -> Dict[str, Any]:
+        """Extract the EXIF fields we care about, if any are present.
+
+        Looks up only the useful tag ids instead of iterating every tag;
+        MakerNote blobs and embedded thumbnails are never touched, and the
+        byte decode runs only for matched values.
+        """
+        exif_data: Dict[str, Any] = {}
+        try:
+            exif = image.getexif()
+            if not exif:
+                return exif_data
+            for tag_id, tag_name in _USEFUL_EXIF_TAGS.items():
+                if tag_id in exif:
+                    value = exif[tag_id]
+                    if isinstance(value, bytes):
+                        value = value.decode("utf-8", errors="replace")
+                    exif_data[tag_name] = value
+        except Exception as e:
+            logger.debug("EXIF extraction failed: %s", e)
+        return exif_data
+
+    def extract_color_info(self, image: Image.Image) -> Dict[str, Any]:
+        """Compute the dominant colour of an image.
+
+        Not part of the default pipeline; callers opt in explicitly. The
+        answer comes from a 64x64 downsample — a full-resolution
+        getcolors() scans every pixel and can allocate a 16M-entry table
+        for the same result.
+        """
+        thumb = image.resize((64, 64), Image.Resampling.BILINEAR).convert("RGB")
+        colors = thumb.getcolors(maxcolors=4096)
+        if not colors:
+            # More than 4096 distinct colours even at 64x64; quantize down.
+            colors = thumb.quantize(colors=8).convert("RGB").getcolors(maxcolors=4096)
+        if not colors:
+            return {}
+        count, dominant = max(colors, key=itemgetter(0))
+        return {"dominant_color": dominant, "dominant_color_share": count / (64 * 64)}
+
+    def create_image_metadata(
+        self,
+        image: Image.Image,
+        has_transparency: Optional[bool] = None,
+        source_size: Optional[Tuple[int, int]] = None,
+    ) -> ImageMetadata:
+        """Build an :class:`ImageMetadata` model from a PIL image."""
+        basic = self.extract_basic_metadata(image, has_transparency, source_size)
+        # Values come straight from PIL and are already well-typed;
+        # model_construct skips per-field validation.
+        return ImageMetadata.model_construct(
+            width=basic["width"],
+            height=basic["height"],
+            mode=basic["mode"],
+            format=basic["format"],
+            has_transparency=basic["has_transparency"],
+            exif=self.extract_exif_data(image),
+        )
+
+    def get_processing_recommendations(self, image: Image.Image) -> List[str]:
+        """Suggest processing options based on the image's properties."""
+        recommendations = []
+        if self._check_transparency(image):
+            recommendations.append("composite transparency over white before JPEG output")
+        if image.width > 4096 or image.height > 4096:
+            recommendations.append("downscale before archival to save storage")
+        return recommendations
@@ -0,0 +1,92 @@
+"""Data models for documents, pages and image metadata."""
+
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, field_validator
+
+
+class ImageMetadata(BaseModel):
+    """Metadata extracted from a processed image."""
+
+    width: int = Field(..., description="Image width in pixels")
+    height: int = Field(..., description="Image height in pixels")
+    mode: str = Field(..., description="PIL image mode of the source")
+    format: Optional[str] = Field(default=None, description="Source image format")
+    has_transparency: bool = Field(default=False, description="Whether the source had an alpha channel")
+    exif: Dict[str, Any] = Field(default_factory=dict, description="Selected EXIF fields")
+
+    @field_validator("width", "height")
+    @classmethod
+    def dimensions_positive(cls, value):
+        if value <= 0:
+            raise ValueError("image dimensions must be positive")
+        return value
+
+
+class Page(BaseModel):
+    """A single page of a document; for images there is exactly one.
+
+    Assignment validation stays off (pinned explicitly) so the bulk
+    attribute writes in ``Document.update_page_references`` are plain
+    setattr calls, not validator passes.
+    """
+
+    model_config = ConfigDict(validate_assignment=False)
+
+    page_number: int = Field(..., description="1-based page index")
+    image_path: str = Field(..., description="Path to the processed image")
+    thumbnail_path: Optional[str] = Field(default=None, description="Path to the thumbnail")
+    metadata: Optional[ImageMetadata] = Field(default=None, description="Extracted image metadata")
+    document_id: Optional[str] = Field(default=None, description="Owning document id")
+    document_name: Optional[str] = Field(default=None, description="Owning document name")
+
+    @field_validator("page_number")
+    @classmethod
+    def page_number_positive(cls, value):
+        if value < 1:
+            raise ValueError("page_number must be >= 1")
+        return value
+
+
+class Document(BaseModel):
+    """A processed document and its pages."""
+
+    model_config = ConfigDict(validate_assignment=False)
+
+    document_id: str = Field(..., description="Unique document identifier")
+    document_name: str = Field(..., description="Human-readable document name")
+    file_path: str = Field(..., description="Path to the primary processed file")
+    pages: List[Page] = Field(default_factory=list, description="Pages belonging to this document")
+    created_at: str = Field(..., description="ISO timestamp of creation")
+
+    _page_index: Optional[Dict[int, "Page"]] = PrivateAttr(default=None)
+
+    def get_page(self, page_number: int) -> Optional[Page]:
+        """Return the page with the given number in O(1)."""
+        if self._page_index is None or len(self._page_index) != len(self.pages):
+            self._page_index = {page.page_number: page for page in self.pages}
+        return self._page_index.get(page_number)
+
+    def update_page_references(self) -> None:
+        """Propagate the document id and name down to every page."""
+        for page in self.pages:
+            page.document_id = self.document_id
+            page.document_name = self.document_name
+
+
+class ProcessImageResponse(BaseModel):
+    """Response body for the /process_image endpoint."""
+
+    success: bool = Field(..., description="Whether processing succeeded")
+    document: Optional[Document] = Field(default=None, description="The resulting document")
+    error: Optional[str] = Field(default=None, description="Error detail when success is false")
+
+
+class HealthResponse(BaseModel):
+    """Response body for the /health endpoint."""
+
+    status: str = Field(..., description="Service status")
+    service: str = Field(..., description="Service name")
+    version: str = Field(..., description="Service version")
+    timestamp: str = Field(..., description="Time the health check was answered")
+    supported_formats: List[str] = Field(default_factory=list, description="Accepted input formats")
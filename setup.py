@@ -0,0 +1,42 @@
+"""Setup script for the Planora image service."""
+
+from pathlib import Path
+
+from setuptools import find_packages, setup
+
+try:
+    from Cython.Build import cythonize
+
+    # Compiled hot paths (RGBA-over-white compositing); optional — every
+    # caller falls back to NumPy when the extension isn't built.
+    ext_modules = cythonize(
+        ["image_service/_fast.pyx"],
+        compiler_directives={
+            "boundscheck": False,
+            "wraparound": False,
+            "cdivision": True,
+        },
+    )
+except ImportError:
+    ext_modules = []
+
+
+def read_requirements():
+    lines = Path("requirements.txt").read_text().splitlines()
+    return [line.strip() for line in lines if line.strip() and not line.startswith("#")]
+
+
+setup(
+    name="planora-image-service",
+    version="1.0.0",
+    description="Image optimization and document conversion service",
+    packages=find_packages(include=["image_service", "image_service.*"]),
+    python_requires=">=3.10",
+    install_requires=read_requirements(),
+    ext_modules=ext_modules,
+    entry_points={
+        "console_scripts": [
+            "planora-images=image_service.cli:app",
+        ],
+    },
+)